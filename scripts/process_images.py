@@ -17,23 +17,43 @@ Usage:
 from __future__ import annotations
 
 import argparse
+import asyncio
 import csv
+import json
 import os
 import re
 import sys
-import time
+import threading
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import shutil
-import requests
-from PIL import Image
+import aiohttp
+import PIL
+from PIL import Image, features
 
 
 DEFAULT_MAX_SIZE = 300
+DEFAULT_CONCURRENCY = 12
+FLUSH_EVERY = 25
+RESIZED_COL = "Resized Image Path"
+WEB_RESIZED_PREFIX = "assets/images/resized"
+THUMB_FORMATS = ("keep", "webp")
+# Formats browsers display natively, with the suffixes an unmodified original may keep
+WEB_SAFE_EXTS = {"PNG": (".png",), "JPEG": (".jpg", ".jpeg"), "WEBP": (".webp",)}
+CLEAN_COLUMNS = ("Category", "Name", "Type", "Subtype", "Source", "Image Link")
+CHUNK_SIZE = 1 << 20
+RETRY_BACKOFF = 1.5
 HEADERS = {"User-Agent": "Helldivers2SlotMachine/1.0 (+https://example.local)"}
 
+_QUOTE_TABLE = str.maketrans({"\u201c": '"', "\u201d": '"', "\u2019": "'"})
+_SLUG_NONALNUM = re.compile(r"[^a-z0-9]+")
+_SLUG_DASHES = re.compile(r"-+")
+_URL_QUERY = re.compile(r"\?.*$")
+
 
 def slugify(value: str) -> str:
     """Create a URL/file-system friendly slug.
@@ -44,83 +64,222 @@ def slugify(value: str) -> str:
     """
     value = (value or "").strip().lower()
     # Replace unicode quotes and special chars first
-    value = value.replace("\u201c", '"').replace("\u201d", '"').replace("\u2019", "'")
+    value = value.translate(_QUOTE_TABLE)
     # Replace anything not a-z0-9 with -
-    value = re.sub(r"[^a-z0-9]+", "-", value)
-    value = re.sub(r"-+", "-", value)
+    value = _SLUG_NONALNUM.sub("-", value)
+    value = _SLUG_DASHES.sub("-", value)
     return value.strip("-") or "item"
 
 
-def ensure_dir(p: Path) -> None:
-    p.mkdir(parents=True, exist_ok=True)
+# Directories already created (or known to exist) in this process
+_dir_cache: set[str] = set()
 
 
-def ext_from_content_type(ct: Optional[str]) -> str:
-    if not ct:
-        return ".png"
-    ct = ct.split(";")[0].strip().lower()
-    mapping = {
-        "image/png": ".png",
-        "image/jpeg": ".jpg",
-        "image/jpg": ".jpg",
-        "image/webp": ".webp",
-        "image/gif": ".gif",
-        "image/svg+xml": ".svg",
-    }
-    return mapping.get(ct, ".png")
+def ensure_dir(p: Path) -> None:
+    key = str(p)
+    if key in _dir_cache:
+        return
+    p.mkdir(parents=True, exist_ok=True)
+    _dir_cache.add(key)
+
+
+IMAGE_EXTS = frozenset({".png", ".jpg", ".jpeg", ".webp", ".gif", ".svg"})
+# Leading bytes -> extension; WebP (RIFF....WEBP) is checked separately in sniff_ext
+_MAGIC_EXTS = {
+    b"\x89PNG": ".png",
+    b"\xff\xd8\xff": ".jpg",
+    b"GIF8": ".gif",
+    b"<?xml": ".svg",
+    b"<svg": ".svg",
+}
+
+
+def sniff_ext(path: Path) -> str:
+    """Identify an image from its first bytes; returns "" if the type isn't recognised."""
+    with open(path, "rb") as f:
+        head = f.read(16)
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    head = head.removeprefix(b"\xef\xbb\xbf").lstrip()
+    for magic, ext in _MAGIC_EXTS.items():
+        if head.startswith(magic):
+            return ext
+    return ""
 
 
 def ext_from_url(url: str) -> str:
-    path = re.sub(r"\?.*$", "", url)
+    path = _URL_QUERY.sub("", url)
     _, ext = os.path.splitext(path)
     if ext and len(ext) <= 5:
         return ext.lower()
     return ""
 
 
-def download_file(url: str, dest: Path, max_retries: int = 3, timeout: int = 20) -> bool:
-    """Download a URL to dest atomically; returns True if file was fetched/exists."""
-    if dest.exists() and dest.stat().st_size > 0:
-        return True
+def index_existing(root: Path) -> Dict[str, List[str]]:
+    """Map "<dir>/<stem>" to the non-empty image files under root, with one scandir per directory.
+    Lets callers check for earlier downloads, whatever their suffix, without a stat per row.
+    """
+    found: Dict[str, List[str]] = {}
+    stack = [str(root)]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except FileNotFoundError:
+            continue
+        with it:
+            for entry in sorted(it, key=lambda e: e.name):
+                if entry.is_dir():
+                    stack.append(entry.path)
+                    continue
+                stem, ext = os.path.splitext(entry.path)
+                if ext.lower() in IMAGE_EXTS and entry.stat().st_size > 0:
+                    found.setdefault(stem, []).append(entry.path)
+    return found
+
+
+def find_existing(existing: Dict[str, List[str]], dest: str) -> Optional[str]:
+    """Return a previously downloaded file for dest, preferring an exact suffix match."""
+    candidates = existing.get(os.path.splitext(dest)[0])
+    if not candidates:
+        return None
+    return dest if dest in candidates else candidates[0]
+
+
+async def fetch(
+    session: aiohttp.ClientSession,
+    sem: asyncio.Semaphore,
+    url: str,
+    dest: Path,
+    http_cache: Optional[Dict[str, Dict[str, str]]] = None,
+    revalidate: bool = False,
+    max_retries: int = 3,
+    timeout: int = 20,
+) -> Optional[Path]:
+    """Download a URL to dest atomically; returns the final path, or None on failure.
+
+    The suffix of dest is corrected to match the downloaded bytes (see sniff_ext).
+    ETag/Last-Modified from the response are recorded in http_cache under url. With
+    revalidate, dest already exists and is only replaced if the server says it changed.
+    """
+    cached = (http_cache or {}).get(url, {}) if revalidate else {}
+    conditional: Dict[str, str] = {}
+    if cached.get("path") == str(dest):
+        if cached.get("etag"):
+            conditional["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            conditional["If-Modified-Since"] = cached["last_modified"]
     tmp = dest.with_suffix(dest.suffix + ".part")
+    # Like requests' timeout: bounds connecting and each read, not the whole transfer
+    client_timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
     for attempt in range(1, max_retries + 1):
         try:
-            with requests.get(url, stream=True, headers=HEADERS, timeout=timeout) as r:
-                r.raise_for_status()
-                ensure_dir(dest.parent)
-                with open(tmp, "wb") as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        if chunk:
+            async with sem:
+                async with session.get(url, headers=conditional, timeout=client_timeout) as resp:
+                    if resp.status == 304:
+                        return dest
+                    resp.raise_for_status()
+                    validators = {
+                        "etag": resp.headers.get("ETag", ""),
+                        "last_modified": resp.headers.get("Last-Modified", ""),
+                    }
+                    ensure_dir(dest.parent)
+                    with open(tmp, "wb") as f:
+                        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
                             f.write(chunk)
+            # Trust the bytes over the URL/extension guess (".jpeg" is fine for JPEG)
+            real_ext = sniff_ext(tmp)
+            if real_ext and real_ext != dest.suffix.lower().replace(".jpeg", ".jpg"):
+                dest = dest.with_suffix(real_ext)
             tmp.replace(dest)
-            return True
+            if http_cache is not None:
+                http_cache[url] = {**validators, "path": str(dest)}
+            return dest
         except Exception as e:
             if tmp.exists():
                 try:
                     tmp.unlink()
                 except Exception:
                     pass
-            if attempt == max_retries:
-                print(f"ERROR: Failed to download {url}: {e}", file=sys.stderr)
-                return False
-            time.sleep(1.5 * attempt)
-    return False
+            # Client errors other than rate limiting won't change on retry
+            permanent = isinstance(e, aiohttp.ClientResponseError) and e.status < 500 and e.status != 429
+            if permanent or attempt == max_retries:
+                print(f"ERROR: Failed to download {url}: {type(e).__name__}: {e}", file=sys.stderr)
+                return None
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+    return None
+
+
+def link_or_copy(src: Path, dest: Path) -> None:
+    """Place src at dest as a hardlink, falling back to a copy (e.g. across filesystems).
+    Does nothing if dest is already src or a copy at least as new as src.
+    """
+    src_stat = src.stat()
+    try:
+        dest_stat = dest.stat()
+    except FileNotFoundError:
+        pass
+    else:
+        if os.path.samestat(src_stat, dest_stat) or dest_stat.st_mtime >= src_stat.st_mtime:
+            return
+        dest.unlink()
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+# Per-thread white canvas used to flatten alpha for JPEG output, reused across images
+_bg_cache = threading.local()
 
 
-def resize_image(src: Path, dest: Path, max_size: int = DEFAULT_MAX_SIZE) -> Tuple[int, int]:
+def white_background(size: Tuple[int, int]) -> Image.Image:
+    """Return an opaque white RGBA image of size, cropped from a cached per-thread canvas."""
+    bg = getattr(_bg_cache, "image", None)
+    if bg is None or bg.width < size[0] or bg.height < size[1]:
+        width = max(size[0], bg.width if bg else 0)
+        height = max(size[1], bg.height if bg else 0)
+        bg = _bg_cache.image = Image.new("RGBA", (width, height), (255, 255, 255, 255))
+    return bg.crop((0, 0, size[0], size[1]))
+
+
+def resize_image(
+    src: Path, dest: Path, max_size: int = DEFAULT_MAX_SIZE, thumb_format: str = "keep"
+) -> Tuple[Path, Tuple[int, int]]:
     """Resize image to fit within max_size x max_size, keeping aspect ratio.
-    Returns (width, height) of the resized image.
+    With thumb_format="webp", still images are written as WebP regardless of dest's suffix.
+    Returns the path written and (width, height) of the resized image.
     """
     ensure_dir(dest.parent)
-    # Special-case SVG: keep as-is, just copy to destination (vector scales inherently)
+    # Special-case SVG: keep as-is, just link to destination (vector scales inherently)
     if src.suffix.lower() == ".svg":
-        ensure_dir(dest.parent)
-        shutil.copyfile(src, dest)
-        return (0, 0)
+        link_or_copy(src, dest)
+        return dest, (0, 0)
 
     with Image.open(src) as im:
+        # Already small, web-safe and in a mode we'd keep: reuse the original bytes instead
+        # of a decode/resize/encode round trip (which would only lose quality)
+        if (
+            im.width <= max_size
+            and im.height <= max_size
+            and im.mode in ("RGB", "RGBA")
+            and dest.suffix.lower() in WEB_SAFE_EXTS.get(im.format or "", ())
+            and (thumb_format != "webp" or im.format == "WEBP")
+        ):
+            if dest.exists() and not os.path.samefile(src, dest):
+                # A previous encode (e.g. at another --max-size) must not be kept
+                dest.unlink()
+            link_or_copy(src, dest)
+            return dest, im.size
+
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale when the source is much larger
+        if im.format == "JPEG":
+            im.draft("RGB", (max_size * 2, max_size * 2))
+
         # Preserve transparency for PNG/WebP
         format_lower = (im.format or "").lower()
+        # Only the first frame survives resizing, so animations keep their own format
+        if thumb_format == "webp" and not getattr(im, "is_animated", False):
+            dest = dest.with_suffix(".webp")
         has_alpha = im.mode in ("RGBA", "LA") or ("transparency" in im.info)
 
         # Convert paletted images to RGBA to preserve transparency upon resize
@@ -130,24 +289,41 @@ def resize_image(src: Path, dest: Path, max_size: int = DEFAULT_MAX_SIZE) -> Tup
             # Convert other modes to a sane default
             im = im.convert("RGBA" if has_alpha else "RGB")
 
-        im.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        # reducing_gap=2.0 has thumbnail() box-reduce to within 2x of the target first, so
+        # Lanczos only handles the final fractional step (Pillow's default, made explicit)
+        im.thumbnail((max_size, max_size), Image.Resampling.LANCZOS, reducing_gap=2.0)
         save_kwargs = {}
 
         ext = dest.suffix.lower()
-        if ext in (".jpg", ".jpeg"):
+        if thumb_format == "webp" and ext == ".webp":
+            save_kwargs.update({"quality": 85, "method": 6})
+        elif ext in (".jpg", ".jpeg"):
             # JPEG has no alpha; if image has alpha, flatten onto white
             if im.mode == "RGBA":
-                bg = Image.new("RGB", im.size, (255, 255, 255))
-                bg.paste(im, mask=im.split()[3])
-                im = bg
+                im = Image.alpha_composite(white_background(im.size), im).convert("RGB")
             save_kwargs.update({"quality": 90, "optimize": True, "progressive": True})
         elif ext == ".png":
             save_kwargs.update({"optimize": True})
         elif ext == ".webp":
             save_kwargs.update({"quality": 90})
 
+        # dest may be a hardlink to src from an earlier fast-path run; never write through it
+        dest.unlink(missing_ok=True)
         im.save(dest, **save_kwargs)
-        return im.size
+        return dest, im.size
+
+
+def resize_image_worker(job: Tuple[Path, Path, str, int, str]) -> Tuple[str, Tuple[int, int]]:
+    """Process-pool entry point: resize one image, returning (web_rel, size) or ("", (0, 0))."""
+    src, dest, web_rel, max_size, thumb_format = job
+    try:
+        written, size = resize_image(src, dest, max_size=max_size, thumb_format=thumb_format)
+        if written.suffix != dest.suffix:
+            web_rel = os.path.splitext(web_rel)[0] + written.suffix
+        return web_rel, size
+    except Exception as e:
+        print(f"ERROR: Failed to process {src}: {e}", file=sys.stderr)
+        return "", (0, 0)
 
 
 @dataclass
@@ -155,16 +331,44 @@ class Paths:
     assets_root: Path
     originals_dir: Path
     resized_dir: Path
+    http_cache_file: Path
 
 
 def build_paths(assets_root: Path) -> Paths:
     originals = assets_root / "original"
     resized = assets_root / "resized"
-    return Paths(assets_root=assets_root, originals_dir=originals, resized_dir=resized)
+    # Sidecar with ETag/Last-Modified per URL, kept next to the assets root
+    http_cache_file = assets_root.parent / f"{assets_root.resolve().name}.http-cache.json"
+    return Paths(assets_root=assets_root, originals_dir=originals, resized_dir=resized,
+                 http_cache_file=http_cache_file)
+
+
+def load_http_cache(path: Path) -> Dict[str, Dict[str, str]]:
+    try:
+        with path.open(encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"WARNING: Ignoring unreadable HTTP cache {path}: {e}", file=sys.stderr)
+        return {}
+
+
+def save_http_cache(path: Path, cache: Dict[str, Dict[str, str]]) -> None:
+    tmp = path.with_suffix(path.suffix + ".part")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    tmp.replace(path)
+
+
+# (assets_root, category, type) -> (original dir, resized dir, web dir); many rows share these
+_type_dirs: Dict[Tuple[str, str, str], Tuple[str, str, str]] = {}
 
 
-def compute_file_paths(paths: Paths, row: Dict[str, str], url: str) -> Tuple[Path, Path, str]:
-    """Compute original and resized file paths and the web-friendly relative path to resized."""
+def compute_file_paths(paths: Paths, row: Dict[str, str], url: str) -> Tuple[str, str, str]:
+    """Compute original and resized file paths and the web-friendly relative path to resized.
+    Plain strings are returned; callers wrap them in Path only where file APIs need one.
+    """
     category = slugify(row.get("Category", "misc"))
     type_ = slugify(row.get("Type", "misc"))
     name = slugify(row.get("Name", "item"))
@@ -174,18 +378,157 @@ def compute_file_paths(paths: Paths, row: Dict[str, str], url: str) -> Tuple[Pat
     if not ext:
         ext = ".png"
 
-    rel = Path("resized") / category / type_ / f"{name}{ext}"
-    orig_rel = Path("original") / category / type_ / f"{name}{ext}"
+    key = (str(paths.assets_root), category, type_)
+    dirs = _type_dirs.get(key)
+    if dirs is None:
+        dirs = _type_dirs[key] = (
+            os.path.join(str(paths.originals_dir), category, type_),
+            os.path.join(str(paths.resized_dir), category, type_),
+            # Web path always uses POSIX separators
+            f"{WEB_RESIZED_PREFIX}/{category}/{type_}",
+        )
+    orig_dir, resized_dir, web_dir = dirs
+
+    filename = f"{name}{ext}"
+    return (
+        os.path.join(orig_dir, filename),
+        os.path.join(resized_dir, filename),
+        f"{web_dir}/{filename}",
+    )
+
+
+async def download_row(
+    session: aiohttp.ClientSession,
+    sem: asyncio.Semaphore,
+    paths: Paths,
+    existing: Dict[str, List[str]],
+    http_cache: Dict[str, Dict[str, str]],
+    refresh: bool,
+    row: Dict[str, str],
+) -> Optional[Tuple[Path, Path, str]]:
+    """Download the image for a single row.
+    Returns (original_path, resized_path, web_rel) to resize, or None if there is nothing to resize.
+    """
+    url = row_url(row)
+    if not url:
+        return None
+
+    # Compute paths and download
+    original_path, resized_path, web_rel = compute_file_paths(paths, row, url)
+
+    # Reuse an earlier download if present (revalidating it with --refresh)
+    downloaded = find_existing(existing, original_path)
+    if downloaded is None or refresh:
+        fetched = await fetch(
+            session, sem, url, Path(downloaded or original_path),
+            http_cache=http_cache, revalidate=downloaded is not None,
+        )
+        if fetched is not None:
+            downloaded = str(fetched)
+        elif downloaded is not None:
+            print(f"WARNING: Could not revalidate {url}; keeping {downloaded}", file=sys.stderr)
+    if downloaded is None:
+        return None
+    original_path = downloaded
+    ext = os.path.splitext(original_path)[1]
+    if not resized_path.endswith(ext):
+        resized_path = os.path.splitext(resized_path)[0] + ext
+        web_rel = os.path.splitext(web_rel)[0] + ext
+
+    return Path(original_path), Path(resized_path), web_rel
+
+
+async def download_rows(
+    rows: List[Dict[str, str]], paths: Paths, concurrency: int, refresh: bool = False
+) -> List[Optional[Tuple[Path, Path, str]]]:
+    """Download images for all rows concurrently, sharing one HTTP session; preserves row order."""
+    sem = asyncio.Semaphore(concurrency)
+    existing = index_existing(paths.originals_dir)
+    http_cache = load_http_cache(paths.http_cache_file)
+    # One pooled, keep-alive session for every request so connections (and TLS
+    # handshakes) are reused across rows hitting the same host
+    connector = aiohttp.TCPConnector(
+        limit=concurrency, limit_per_host=concurrency, ttl_dns_cache=300, keepalive_timeout=30
+    )
+    async with aiohttp.ClientSession(connector=connector, headers=HEADERS, read_bufsize=CHUNK_SIZE) as session:
+        try:
+            return await asyncio.gather(
+                *(download_row(session, sem, paths, existing, http_cache, refresh, row) for row in rows)
+            )
+        finally:
+            save_http_cache(paths.http_cache_file, http_cache)
+
+
+def clean_rows(rows: List[Dict[str, str]], fieldnames: List[str]) -> None:
+    # Clean whitespace in expected columns; which of them exist is decided once, not per row
+    columns = [k for k in CLEAN_COLUMNS if k in fieldnames]
+    for row in rows:
+        for k in columns:
+            value = row[k]
+            if value:
+                row[k] = value.strip()
+
+
+def row_url(row: Dict[str, str]) -> str:
+    return row.get("Image Link") or row.get("Image", "")
 
-    original_path = paths.assets_root / orig_rel
-    resized_path = paths.assets_root / rel
 
-    # Return web path using POSIX separators
-    web_rel = Path("assets") / "images" / rel
-    return original_path, resized_path, web_rel.as_posix()
+def row_key(row: Dict[str, str]) -> Tuple[str, str, str, str]:
+    """Identify a row across runs by the fields that determine its image paths."""
+    return (row.get("Category", ""), row.get("Type", ""), row.get("Name", ""), row.get("Image Link", ""))
 
 
-def process_csv(input_csv: Path, output_csv: Path, assets_root: Path, max_size: int) -> None:
+def checkpoint_settings_path(csv_path: Path) -> Path:
+    """Sidecar recording the settings a CSV's resized paths were produced with."""
+    return csv_path.with_name(csv_path.name + ".checkpoint.json")
+
+
+def save_checkpoint_settings(csv_path: Path, settings: Dict[str, object]) -> None:
+    with checkpoint_settings_path(csv_path).open("w", encoding="utf-8") as f:
+        json.dump(settings, f, sort_keys=True)
+
+
+def load_completed(
+    output_csv: Path, new_col: str, settings: Dict[str, object], resized_dir: Path
+) -> Dict[Tuple[str, str, str, str], str]:
+    """Read a previous (possibly partial) output CSV; map row_key -> resized path for finished rows.
+    Nothing counts as finished unless the CSV was written with the same settings, and a row only
+    counts if its resized file is still on disk.
+    """
+    if not output_csv.exists():
+        return {}
+    try:
+        with checkpoint_settings_path(output_csv).open(encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        saved = None
+    if saved != settings:
+        return {}
+
+    resized_files = {p for found in index_existing(resized_dir).values() for p in found}
+    prefix = WEB_RESIZED_PREFIX + "/"
+    done: Dict[Tuple[str, str, str, str], str] = {}
+    with output_csv.open(newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            web_rel = row.get(new_col) or ""
+            if not web_rel.startswith(prefix):
+                continue
+            # Also rejects a truncated last line left by a run killed mid-write
+            local = os.path.join(str(resized_dir), *web_rel[len(prefix):].split("/"))
+            if local in resized_files:
+                done[row_key(row)] = web_rel
+    return done
+
+
+def process_csv(
+    input_csv: Path,
+    output_csv: Path,
+    assets_root: Path,
+    max_size: int,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    refresh: bool = False,
+    thumb_format: str = "keep",
+) -> None:
     paths = build_paths(assets_root)
     ensure_dir(paths.originals_dir)
     ensure_dir(paths.resized_dir)
@@ -193,63 +536,81 @@ def process_csv(input_csv: Path, output_csv: Path, assets_root: Path, max_size:
     with input_csv.open(newline="", encoding="utf-8") as f_in:
         reader = csv.DictReader(f_in)
         fieldnames = list(reader.fieldnames or [])
-        new_col = "Resized Image Path"
+        new_col = RESIZED_COL
         if new_col not in fieldnames:
             fieldnames.append(new_col)
-
-        rows_out = []
-        for row in reader:
-            # Clean whitespace in expected columns
-            for k in ("Category", "Name", "Type", "Subtype", "Source", "Image Link"):
-                if k in row and row[k] is not None:
-                    row[k] = row[k].strip()
-
-            url = row.get("Image Link") or row.get("Image", "")
-            if not url:
-                row[new_col] = ""
-                rows_out.append(row)
-                continue
-
-            # Compute paths and download
-            original_path, resized_path, web_rel = compute_file_paths(paths, row, url)
-
-            # Determine extension using content-type if URL lacks one
-            ext = original_path.suffix
-            if ext in ("", ".png"):
-                try:
-                    head = requests.head(url, headers=HEADERS, allow_redirects=True, timeout=10)
-                    ct_ext = ext_from_content_type(head.headers.get("Content-Type"))
-                    if ext == "" and ct_ext:
-                        original_path = original_path.with_suffix(ct_ext)
-                        resized_path = resized_path.with_suffix(ct_ext)
-                        web_rel = Path(web_rel).with_suffix(ct_ext).as_posix()
-                except Exception:
-                    pass
-
-            ok = download_file(url, original_path)
-            if not ok:
-                row[new_col] = ""
-                rows_out.append(row)
-                continue
-
-            try:
-                resize_image(original_path, resized_path, max_size=max_size)
-                row[new_col] = web_rel
-            except Exception as e:
-                print(f"ERROR: Failed to process {original_path}: {e}", file=sys.stderr)
-                row[new_col] = ""
-
-            rows_out.append(row)
-
-    with output_csv.open("w", newline="", encoding="utf-8") as f_out:
+        rows = list(reader)
+    clean_rows(rows, fieldnames)
+
+    # Rows finished by an earlier run with the same settings are carried over instead of
+    # being processed again, unless --refresh asks for everything to be revalidated
+    # Progress goes to a .part file that only replaces output_csv once the run completes; an
+    # interrupted run's .part is read as well so its progress isn't lost
+    part_csv = output_csv.with_name(output_csv.name + ".part")
+    settings: Dict[str, object] = {"max_size": max_size, "thumb_format": thumb_format}
+    done: Dict[Tuple[str, str, str, str], str] = {}
+    if not refresh:
+        for checkpoint in (output_csv, part_csv):
+            done.update(load_completed(checkpoint, new_col, settings, paths.resized_dir))
+    todo = [i for i, row in enumerate(rows) if row_key(row) not in done]
+    todo_set = set(todo)
+    if len(todo) < len(rows):
+        print(f"Resuming: {len(rows) - len(todo)} rows already processed in {output_csv}")
+    finished = {row_url(row): done[row_key(row)] for i, row in enumerate(rows) if i not in todo_set}
+
+    # Rows sharing an image URL are downloaded and resized once; the first one names the files
+    by_url: Dict[str, List[int]] = defaultdict(list)
+    for i in todo:
+        url = row_url(rows[i])
+        if url and url not in finished:
+            by_url[url].append(i)
+    urls = list(by_url)
+    downloads = asyncio.run(download_rows([rows[by_url[u][0]] for u in urls], paths, concurrency, refresh))
+    pending = {u: job for u, job in zip(urls, downloads) if job is not None}
+    jobs = [(src, dest, web_rel, max_size, thumb_format) for src, dest, web_rel in pending.values()]
+
+    # Resizing is CPU-bound; spread it across processes once all downloads are in, and
+    # write each row as soon as its result arrives so an interrupted run can resume
+    save_checkpoint_settings(part_csv, settings)
+    with part_csv.open("w", newline="", encoding="utf-8") as f_out, \
+            ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
         writer = csv.DictWriter(f_out, fieldnames=fieldnames)
         writer.writeheader()
-        for r in rows_out:
-            writer.writerow(r)
+        # Each result is tagged with its URL, so rows never depend on job order
+        results = zip(pending, pool.map(resize_image_worker, jobs, chunksize=8))
+        resized: Dict[str, str] = {}
+        for i, row in enumerate(rows):
+            url = row_url(row)
+            if i in todo_set and url in pending:
+                while url not in resized:
+                    job_url, (web_rel, _size) = next(results)
+                    resized[job_url] = web_rel
+                row[new_col] = resized[url]
+            else:
+                row[new_col] = done.get(row_key(row)) or finished.get(url, "")
+            writer.writerow(row)
+            if (i + 1) % FLUSH_EVERY == 0:
+                f_out.flush()
+    part_csv.replace(output_csv)
+    checkpoint_settings_path(part_csv).replace(checkpoint_settings_path(output_csv))
 
     print(f"Wrote updated CSV: {output_csv}")
 
 
+def check_imaging_backend() -> None:
+    """Log the Pillow build in use and warn if JPEG decode/encode lacks libjpeg-turbo."""
+    jpeglib = getattr(Image.core, "jpeglib_version", None) or "unavailable"
+    turbo = features.check_feature("libjpeg_turbo")
+    turbo_note = f", libjpeg-turbo {features.version_feature('libjpeg_turbo')}" if turbo else ""
+    print(f"Pillow {PIL.__version__} (libjpeg {jpeglib}{turbo_note})")
+    if not turbo:
+        print(
+            "WARNING: Pillow is not built against libjpeg-turbo; JPEG decode/encode will be slower. "
+            "See README for installing Pillow-SIMD with libjpeg-turbo.",
+            file=sys.stderr,
+        )
+
+
 def main(argv: Optional[list[str]] = None) -> int:
     parser = argparse.ArgumentParser(description="Download and resize images from CSV")
     parser.add_argument("--input", "-i", type=str, default="Helldivers Weapons and Strategems - helldivers_2_loadout.csv",
@@ -260,6 +621,13 @@ def main(argv: Optional[list[str]] = None) -> int:
                         help="Root folder to store images (default: assets/images)")
     parser.add_argument("--max-size", type=int, default=DEFAULT_MAX_SIZE,
                         help="Max width/height for resized images (default: 300)")
+    parser.add_argument("--concurrency", "-j", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Max simultaneous downloads (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Revalidate existing downloads with conditional GETs and reprocess every row")
+    parser.add_argument("--thumb-format", choices=THUMB_FORMATS, default="keep",
+                        help="Format for resized images: keep the input's, or encode as WebP (default: keep). "
+                             "Changing it (or --max-size) reprocesses rows already in the output CSV")
 
     args = parser.parse_args(argv)
 
@@ -271,8 +639,10 @@ def main(argv: Optional[list[str]] = None) -> int:
         print(f"Input CSV not found: {input_csv}", file=sys.stderr)
         return 2
 
+    check_imaging_backend()
     try:
-        process_csv(input_csv, output_csv, assets_root, args.max_size)
+        process_csv(input_csv, output_csv, assets_root, args.max_size, max(1, args.concurrency), args.refresh,
+                    args.thumb_format)
     except KeyboardInterrupt:
         print("Aborted", file=sys.stderr)
         return 130